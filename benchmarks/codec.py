@@ -0,0 +1,100 @@
+"""
+Binary codec vs pickle vs JSON: payload size and encode/decode speed for
+parsed Telegram messages. Every message is checked to survive a round-trip.
+
+Usage: python -m benchmarks.codec [count]
+"""
+from core.attachments.general import Forward
+from core.general import Network
+from networks.tg import Telegram, TgMessage
+from core import codec
+from pydantic import BaseModel
+from datetime import datetime
+import asyncio
+import pickle
+import timeit
+import json
+import sys
+
+USER = {'id': 1001, 'is_bot': False, 'first_name': 'James', 'last_name': 'Bond', 'username': 'jb'}
+CHAT = {'id': -100500, 'title': 'Benchmark chat', 'type': 'supergroup'}
+
+
+def make_messages(tg: Telegram, count: int) -> list:
+    messages = []
+    for i in range(count):
+        data = {
+            'message_id': i,
+            'date': 1600000000 + i,
+            'from': USER,
+            'chat': CHAT,
+            'text': f'Hello, world! Message number {i}, see https://example.com',
+            'entities': [
+                {'type': 'bold', 'offset': 0, 'length': 5},
+                {'type': 'italic', 'offset': 14, 'length': 7},
+                {'type': 'url', 'offset': 35 + len(str(i)), 'length': 19},
+            ],
+        }
+        if i % 10 == 0:
+            data['photo'] = [{'file_id': f'f{i}', 'file_unique_id': f'u{i}', 'width': 640, 'height': 480}]
+        message = TgMessage.from_json(tg.pid, data)
+        if i % 20 == 0:
+            forward = Forward(id=tg.pid.clone(), messages=(messages[-1],) if messages else ())
+            message = message.copy(update={'content': message.content + (forward,)})
+        messages.append(message)
+    return messages
+
+
+def json_default(obj):
+    # Best effort JSON baseline: networks by id, trees as HTML
+    if isinstance(obj, Network): return obj.id
+    if isinstance(obj, BaseModel): return obj.__dict__
+    if isinstance(obj, datetime): return obj.isoformat()
+    return str(obj)
+
+
+def check_round_trip(a, b):
+    assert type(a) is type(b), (type(a), type(b))
+    assert a.id == b.id and b.id.origin.id == a.id.origin.id
+    assert a.when == b.when and a.sender.id == b.sender.id and a.chat.id == b.chat.id
+    a_slots, b_slots = a.slots(), b.slots()
+    a_header, b_header = a_slots.pop('_header'), b_slots.pop('_header')
+    assert a_slots == b_slots
+    assert (a_header is None) == (b_header is None)
+    if a_header is not None:
+        assert a_header[:2] == b_header[:2]
+        assert a_header[2].id == b_header[2].id and a_header[3].id == b_header[3].id
+    assert len(a.content) == len(b.content)
+    for x, y in zip(a.content, b.content):
+        assert type(x) is type(y)
+        if hasattr(x, 'tree'): assert str(x.tree) == str(y.tree)
+        if hasattr(x, 'messages'):
+            for m, n in zip(x.messages, y.messages): check_round_trip(m, n)
+        if hasattr(x, '_file_id'): assert (x._file_id, x.type) == (y._file_id, y.type)
+
+
+def bench(name: str, dumps, loads, messages: list):
+    try:
+        payloads = [dumps(x) for x in messages]
+    except Exception as e:
+        return print(f'{name:>8}: failed to encode: {e!r}')
+    size = sum(len(x) for x in payloads) / len(payloads)
+    enc = min(timeit.repeat(lambda: [dumps(x) for x in messages], number=1, repeat=3))
+    dec = min(timeit.repeat(lambda: [loads(x) for x in payloads], number=1, repeat=3))
+    n = len(messages)
+    print(f'{name:>8}: {size:8.0f} B/msg, encode {enc * 1e6 / n:8.1f} us, decode {dec * 1e6 / n:8.1f} us')
+
+
+async def main(count: int):
+    tg = Telegram(token='')
+    networks = {tg.id: tg}
+    messages = make_messages(tg, count)
+    for message in messages:
+        check_round_trip(message, codec.loads(codec.dumps(message), networks))
+    bench('binary', codec.dumps, lambda x: codec.loads(x, networks), messages)
+    bench('pickle', pickle.dumps, pickle.loads, messages)
+    bench('json', lambda x: json.dumps(x, default=json_default).encode(), json.loads, messages)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
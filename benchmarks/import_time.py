@@ -0,0 +1,52 @@
+"""
+Cold-start import cost of core modules, measured with `python -X importtime`
+in a fresh interpreter for every module. Also reports which heavy optional
+dependencies were loaded as a side effect of the import.
+
+Usage: python -m benchmarks.import_time [module ...]
+"""
+from typing import Dict, List, Tuple
+import subprocess
+import sys
+
+DEFAULT_MODULES = (
+    'core',
+    'core.attachments',
+    'networks',
+    'networks.tg',
+)
+HEAVY_MODULES = ('pydantic', 'aiohttp', 'bs4', 'lxml', 'markdown')
+TOP_N = 10
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Import module in a fresh interpreter
+    :return: mapping of module name -> (self, cumulative) time in microseconds
+    """
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def report(module: str):
+    times = import_times(module)
+    total = times[module][1] if module in times else sum(x[0] for x in times.values())
+    loaded: List[str] = [x for x in HEAVY_MODULES if x in times]
+    print(f'{module}: {total / 1000:.1f} ms, heavy deps: {", ".join(loaded) or "-"}')
+    top = sorted(times.items(), key=lambda x: x[1][0], reverse=True)[:TOP_N]
+    for name, (own, _) in top:
+        print(f'    {own / 1000:8.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    for module in sys.argv[1:] or DEFAULT_MODULES:
+        report(module)
@@ -0,0 +1,63 @@
+"""
+Memory footprint of parsed Telegram messages per 100k messages, measured
+with tracemalloc for default, compact and compact + keep_raw modes.
+
+Usage: python -m benchmarks.memory_compact [count]
+"""
+from networks.tg import Telegram, TgMessage
+import tracemalloc
+import json
+import asyncio
+import sys
+
+
+def make_update(i: int) -> dict:
+    return {
+        'message_id': i,
+        'date': 1600000000 + i // 3,
+        'from': {
+            'id': 1000 + i % 50,
+            'is_bot': False,
+            'first_name': 'James',
+            'last_name': 'Bond',
+            'username': 'jamesbond',
+            'language_code': 'en',
+        },
+        'chat': {
+            'id': -100500,
+            'title': 'Benchmark chat',
+            'type': 'supergroup',
+        },
+        'text': f'message number {i}',
+    }
+
+
+def measure(tg: Telegram, count: int) -> int:
+    # Payloads are decoded inside the measured section, as they would be when
+    # received from the API, so whatever the messages keep alive is counted
+    payloads = [json.dumps(make_update(i)) for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = [TgMessage.from_json(tg.pid, json.loads(x)) for x in payloads]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del messages
+    return after - before
+
+
+async def main(count: int):
+    modes = {
+        'default': {},
+        'compact': {'compact_mode': True},
+        'compact+raw': {'compact_mode': True, 'keep_raw': True},
+    }
+    for name, options in modes.items():
+        tg = Telegram(token='', **options)
+        size = measure(tg, count)
+        per_100k = size * 100_000 / count
+        print(f'{name:>12}: {per_100k / 2 ** 20:8.1f} MiB per 100k messages')
+        if tg.http is not None: await tg.http.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
@@ -1,5 +1,6 @@
 from .general import (
     Network,
+    RawJSON,
     ID,
     Type,
     User,
@@ -11,6 +12,7 @@ from .general import (
 
 __all__ = [
     'Network',
+    'RawJSON',
     'ID',
     'Type',
     'User',
@@ -1,5 +1,5 @@
 from core import Attachment
-from .text import *
+from .text import Text
 
 __all__ = [
     'Attachment',
@@ -30,6 +30,13 @@ class Document(Attachment):
     size: int = -1
     do_not_process: bool = False
 
+    async def resolve_url(self) -> Optional[str]:
+        """
+        Download URL of the file. Networks may resolve it lazily (and leave
+        url unset), so use this instead of reading url directly
+        """
+        return self.url
+
     async def download(self, offset: int = 0, limit: int = -1) -> bytes:
         """
         Download file contents
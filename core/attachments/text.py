@@ -1,14 +1,19 @@
 from core import Attachment, ID
-from bs4 import BeautifulSoup
-from markdown import markdown
-from html import escape
+from typing import Any, Iterable, List, TYPE_CHECKING
+from html import escape, unescape
+import re
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+    from xml.etree.ElementTree import Element
 
 
 class Text(Attachment):
     """
     Arbitrary tree-like text content
     """
-    tree: BeautifulSoup
+    # BeautifulSoup tree (bs4 & lxml are imported on first parse)
+    tree: Any
 
     class Config:
         arbitrary_types_allowed = True
@@ -19,8 +24,84 @@ class Text(Attachment):
 
     @staticmethod
     def from_markdown(pid: ID, md: str) -> 'Text':
-        return Text.from_html(pid, markdown(md))
+        return Text(id=pid.clone(), tree=MarkdownTreeBuilder().build(md))
+
+    @staticmethod
+    def from_markdown_many(pid: ID, mds: Iterable[str]) -> List['Text']:
+        # One parser for the whole batch: parser setup is not repeated per
+        # document, which only matters for short ones
+        builder = MarkdownTreeBuilder()
+        return [Text(id=pid.clone(), tree=builder.build(md)) for md in mds]
 
     @staticmethod
     def from_html(pid: ID, html: str):
-        return Text(id=pid.clone(), tree=BeautifulSoup(html, 'lxml'))
+        return Text(id=pid.clone(), tree=make_soup(html))
+
+
+def make_soup(html: str) -> 'BeautifulSoup':
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, 'lxml')
+
+
+class MarkdownTreeBuilder:
+    """
+    Builds BeautifulSoup tree straight from Python-Markdown's element tree,
+    without serializing it to HTML and parsing it again. Documents with raw
+    HTML fall back to the HTML round-trip (markdown only resolves it there).
+    Builder keeps parser state: use one instance per thread
+    """
+    # Backslash escapes left by markdown: STX + ord(char) + ETX
+    ESCAPE_RE = re.compile(r'\x02(\d+)\x03')
+    # Entities are kept as-is by markdown's serializer (i.e. in code spans)
+    ENTITY_RE = re.compile(r'&(?:#[0-9]+|#x[0-9a-f]+|[0-9a-z]+);', re.IGNORECASE)
+
+    def __init__(self):
+        from markdown import Markdown, util
+        self.md = Markdown()
+        self.amp_substitute = util.AMP_SUBSTITUTE
+
+    def build(self, source: str) -> 'BeautifulSoup':
+        md = self.md.reset()
+        soup = make_soup('')
+        if not source.strip(): return soup
+        # Same steps as Markdown.convert(), up to serialization
+        md.lines = source.split('\n')
+        for prep in md.preprocessors:
+            md.lines = prep.run(md.lines)
+        root = md.parser.parseDocument(md.lines).getroot()
+        for treeprocessor in md.treeprocessors:
+            new_root = treeprocessor.run(root)
+            if new_root is not None: root = new_root
+        if md.htmlStash.html_counter:
+            return make_soup(md.reset().convert(source))
+        # Feed the tree through bs4's parser event interface: much cheaper
+        # than linking every node with Tag.append()
+        soup.handle_starttag('html', None, None, {})
+        soup.handle_starttag('body', None, None, {})
+        text = (root.text or '').lstrip()
+        if text: soup.handle_data(self.unescape(text))
+        for i, child in enumerate(root):
+            self.feed(soup, child, last=i == len(root) - 1)
+        soup.handle_endtag('body')
+        soup.handle_endtag('html')
+        soup.endData()
+        return soup
+
+    def feed(self, soup: 'BeautifulSoup', element: 'Element', last: bool = False):
+        attrs = {k: self.unescape(v) for k, v in element.attrib.items()}
+        soup.handle_starttag(element.tag, None, None, attrs)
+        if element.text: soup.handle_data(self.unescape(element.text))
+        for child in element:
+            self.feed(soup, child)
+        soup.handle_endtag(element.tag)
+        # Markdown strips the resulting HTML as a whole
+        tail = (element.tail or '').rstrip() if last else element.tail
+        if tail: soup.handle_data(self.unescape(tail))
+
+    def unescape(self, text: str) -> str:
+        if '\x02' in text:
+            text = self.ESCAPE_RE.sub(lambda m: chr(int(m.group(1))), text)
+        text = text.replace(self.amp_substitute, '&')
+        if '&' in text:
+            text = self.ENTITY_RE.sub(lambda m: unescape(m.group(0)), text)
+        return text
@@ -0,0 +1,410 @@
+"""
+Versioned binary codec for core types (ID, User, Chat, Message, attachments)
+
+Networks are encoded by id and resolved on decoding, text trees are flattened
+into a self-contained token stream and rebuilt only when accessed (LazyTree).
+Only classes registered with register() can be encoded and decoded
+"""
+from core.general import Network, RawJSON, ID, Locale, User, ChatType, Chat, Message, Attachment
+from core.attachments.general import Forward, DocumentType, Document
+from core.attachments.text import Text
+from typing import Any, Callable, Dict, Mapping, Union
+from datetime import datetime, timezone
+from pydantic import BaseModel
+from enum import Enum
+import struct
+import sys
+
+MAGIC = b'\xbaT'
+VERSION = 1
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Value tags
+(
+    NONE, TRUE, FALSE, INT, FLOAT, STR, BYTES, LIST, TUPLE, DICT,
+    DATETIME, DATETIME_ISO, ENUM, NETWORK, MODEL, RAW_JSON, TREE,
+) = range(17)
+# Text tree tokens
+OPEN, TEXT, CLOSE = range(3)
+
+NetworkResolver = Union[Mapping[str, Network], Callable[[str], Network]]
+
+
+class Writer:
+    def __init__(self):
+        self.buf = bytearray()
+        # Repeated names (fields, classes, tags) are written once per payload
+        self.symbols: Dict[str, int] = {}
+        # Same for raw JSON payloads shared by a message and its nested objects
+        self.blobs: Dict[bytes, int] = {}
+
+    def varint(self, n: int):
+        while n > 0x7f:
+            self.buf.append(n & 0x7f | 0x80)
+            n >>= 7
+        self.buf.append(n)
+
+    def bytes(self, data: bytes):
+        self.varint(len(data))
+        self.buf += data
+
+    def string(self, s: str):
+        self.bytes(s.encode())
+
+    def symbol(self, s: str):
+        # Known symbol: index + 1, new symbol: 0 followed by the literal
+        index = self.symbols.get(s)
+        if index is not None: return self.varint(index + 1)
+        self.symbols[s] = len(self.symbols)
+        self.varint(0)
+        self.string(s)
+
+    def blob(self, data: bytes):
+        index = self.blobs.get(data)
+        if index is not None: return self.varint(index + 1)
+        self.blobs[data] = len(self.blobs)
+        self.varint(0)
+        self.bytes(data)
+
+
+class Reader:
+    def __init__(self, data: bytes, pos: int = 0):
+        self.data = memoryview(data)
+        self.pos = pos
+        self.symbols = []
+        self.blobs = []
+
+    def take(self, size: int) -> memoryview:
+        if self.pos + size > len(self.data):
+            raise ValueError('Corrupted payload: truncated')
+        self.pos += size
+        return self.data[self.pos - size:self.pos]
+
+    def byte(self) -> int:
+        return self.take(1)[0]
+
+    def varint(self) -> int:
+        n = shift = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7f) << shift
+            if b < 0x80: return n
+            shift += 7
+
+    def bytes(self) -> bytes:
+        return bytes(self.take(self.varint()))
+
+    def string(self) -> str:
+        return self.bytes().decode()
+
+    def symbol(self) -> str:
+        index = self.varint()
+        if index: return self.symbols[index - 1]
+        s = self.string()
+        self.symbols.append(s)
+        return s
+
+    def blob(self) -> bytes:
+        index = self.varint()
+        if index: return self.blobs[index - 1]
+        data = self.bytes()
+        self.blobs.append(data)
+        return data
+
+
+def class_ref(cls: type) -> str:
+    return f'{cls.__module__}:{cls.__qualname__}'
+
+
+# Class reference -> model or enum class allowed in payloads
+REGISTRY: Dict[str, type] = {}
+
+
+def register(*classes: type):
+    """
+    Allow model / enum classes (i.e. network-specific types) in payloads
+    """
+    for cls in classes:
+        if not issubclass(cls, (BaseModel, Enum)):
+            raise TypeError(f'Not a model or enum class: {cls}')
+        REGISTRY[class_ref(cls)] = cls
+
+
+def registered_ref(cls: type) -> str:
+    ref = class_ref(cls)
+    if REGISTRY.get(ref) is not cls:
+        raise TypeError(f'Class is not registered for binary encoding: {ref}')
+    return ref
+
+
+def resolve_class(ref: str) -> type:
+    # Payload never causes imports: only already registered classes are used
+    cls = REGISTRY.get(ref)
+    if cls is None:
+        raise ValueError(f'Unknown class in payload: {ref}')
+    return cls
+
+
+register(ID, Locale, User, ChatType, Chat, Message, Attachment, Forward, DocumentType, Document, Text)
+
+
+def is_soup(obj: Any) -> bool:
+    # No need to import bs4 if no tree was ever built
+    bs4 = sys.modules.get('bs4')
+    return bs4 is not None and isinstance(obj, bs4.BeautifulSoup)
+
+
+class LazyTree:
+    """
+    Proxy for BeautifulSoup tree, rebuilt from flat representation on first
+    access. Encoding a LazyTree again reuses flat data without building a tree
+    """
+    __slots__ = ('data', '_soup')
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._soup = None
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            self._soup = decode_tree(self.data)
+        return self._soup
+
+    def __getattr__(self, item):
+        # Private & magic names are never delegated, slots may be unset (i.e.
+        # during copying) and looking them up in the tree would recurse
+        if item.startswith('_'): raise AttributeError(item)
+        return getattr(self.soup, item)
+
+    def __reduce__(self):
+        return LazyTree, (self.data,)
+
+    def __iter__(self):
+        return iter(self.soup)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyTree): other = other.soup
+        return self.soup == other
+
+    def __str__(self):
+        return str(self.soup)
+
+    def __repr__(self):
+        return repr(self.soup)
+
+
+def encode_tree(soup) -> bytes:
+    from bs4 import Tag
+    w = Writer()
+
+    def walk(node):
+        for child in node.children:
+            if isinstance(child, Tag):
+                w.buf.append(OPEN)
+                w.symbol(child.name)
+                w.varint(len(child.attrs))
+                for key, value in child.attrs.items():
+                    w.symbol(key)
+                    # Multi-valued attributes (i.e. class) are kept as lists
+                    values = value if isinstance(value, list) else [value]
+                    w.varint(len(values) * 2 + isinstance(value, list))
+                    for x in values: w.string(str(x))
+                walk(child)
+                w.buf.append(CLOSE)
+            else:
+                w.buf.append(TEXT)
+                w.string(str(child))
+
+    walk(soup)
+    return bytes(w.buf)
+
+
+def decode_tree(data: bytes):
+    from core.attachments.text import make_soup
+    soup = make_soup('')
+    r = Reader(data)
+    names = []
+    while r.pos < len(data):
+        token = r.byte()
+        if token == OPEN:
+            name = r.symbol()
+            attrs = {}
+            for _ in range(r.varint()):
+                key = r.symbol()
+                count = r.varint()
+                values = [r.string() for _ in range(count // 2)]
+                attrs[key] = values if count & 1 else values[0]
+            tag = soup.handle_starttag(name, None, None, dict(attrs))
+            # bs4 splits string values of multi-valued attributes into lists
+            tag.attrs = attrs
+            names.append(name)
+        elif token == TEXT:
+            soup.handle_data(r.string())
+        elif token == CLOSE:
+            soup.handle_endtag(names.pop())
+        else:
+            raise ValueError(f'Corrupted text tree: unknown token {token}')
+    soup.endData()
+    return soup
+
+
+class Encoder:
+    def __init__(self):
+        self.w = Writer()
+
+    def encode(self, obj: Any) -> bytes:
+        self.w.buf += MAGIC
+        self.w.varint(VERSION)
+        self.value(obj)
+        return bytes(self.w.buf)
+
+    def value(self, obj: Any):
+        w = self.w
+        if obj is None: w.buf.append(NONE)
+        elif obj is True: w.buf.append(TRUE)
+        elif obj is False: w.buf.append(FALSE)
+        elif isinstance(obj, Enum):
+            w.buf.append(ENUM)
+            w.symbol(registered_ref(type(obj)))
+            self.value(obj.value)
+        elif isinstance(obj, int):
+            w.buf.append(INT)
+            # Zigzag encoding: small negative numbers stay short
+            w.varint(obj * 2 if obj >= 0 else -obj * 2 - 1)
+        elif isinstance(obj, float):
+            w.buf.append(FLOAT)
+            w.buf += struct.pack('<d', obj)
+        elif isinstance(obj, str):
+            w.buf.append(STR)
+            w.string(obj)
+        elif isinstance(obj, bytes):
+            w.buf.append(BYTES)
+            w.bytes(obj)
+        elif isinstance(obj, datetime):
+            if obj.tzinfo is timezone.utc and obj >= EPOCH:
+                w.buf.append(DATETIME)
+                w.varint((obj - EPOCH) // datetime.resolution)
+            else:
+                w.buf.append(DATETIME_ISO)
+                w.string(obj.isoformat())
+        elif isinstance(obj, Network):
+            w.buf.append(NETWORK)
+            w.symbol(obj.id)
+        elif isinstance(obj, BaseModel):
+            w.buf.append(MODEL)
+            w.symbol(registered_ref(type(obj)))
+            # Includes extra attributes (i.e. private fields of network types).
+            # Defaults are restored by construct() and not written, as well as
+            # descriptors (i.e. async properties) pydantic treats as fields
+            fields = type(obj).__fields__
+            values = [
+                (name, value) for name, value in obj.__dict__.items()
+                if name not in fields or not (
+                    value is fields[name].default or hasattr(type(value), '__get__')
+                )
+            ]
+            w.varint(len(values))
+            for name, value in values:
+                w.symbol(name)
+                self.value(value)
+        elif isinstance(obj, RawJSON):
+            w.buf.append(RAW_JSON)
+            w.blob(obj._encoded)
+            w.varint(len(obj._path))
+            for key in obj._path: self.value(key)
+        elif isinstance(obj, LazyTree):
+            w.buf.append(TREE)
+            w.bytes(obj.data)
+        elif is_soup(obj):
+            w.buf.append(TREE)
+            w.bytes(encode_tree(obj))
+        elif isinstance(obj, (list, tuple)):
+            w.buf.append(LIST if isinstance(obj, list) else TUPLE)
+            w.varint(len(obj))
+            for x in obj: self.value(x)
+        elif isinstance(obj, dict):
+            w.buf.append(DICT)
+            w.varint(len(obj))
+            for k, v in obj.items():
+                self.value(k)
+                self.value(v)
+        else:
+            raise TypeError(f'Unsupported type for binary encoding: {type(obj)}')
+
+
+class Decoder:
+    def __init__(self, data: bytes, networks: NetworkResolver):
+        self.r = Reader(data)
+        self.networks = networks.__getitem__ if isinstance(networks, Mapping) else networks
+
+    def decode(self) -> Any:
+        r = self.r
+        if bytes(r.data[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Not a binary-encoded payload')
+        r.pos = len(MAGIC)
+        version = r.varint()
+        if version != VERSION:
+            raise ValueError(f'Unsupported payload version: {version} (expected {VERSION})')
+        return self.value()
+
+    def value(self) -> Any:
+        r = self.r
+        tag = r.byte()
+        if tag == NONE: return None
+        if tag == TRUE: return True
+        if tag == FALSE: return False
+        if tag == INT:
+            n = r.varint()
+            return n // 2 if not n & 1 else -(n + 1) // 2
+        if tag == FLOAT:
+            return struct.unpack('<d', r.take(8))[0]
+        if tag == STR: return r.string()
+        if tag == BYTES: return r.bytes()
+        if tag == ENUM:
+            cls = resolve_class(r.symbol())
+            return cls(self.value())
+        if tag == DATETIME:
+            return EPOCH + r.varint() * datetime.resolution
+        if tag == DATETIME_ISO: return datetime.fromisoformat(r.string())
+        if tag == NETWORK: return self.networks(r.symbol())
+        if tag == MODEL:
+            cls = resolve_class(r.symbol())
+            values = {}
+            for _ in range(r.varint()):
+                name = r.symbol()
+                values[name] = self.value()
+            # Values were validated before encoding. Defaults are passed as-is,
+            # construct() would deep-copy every one of them
+            fields_set = set(values)
+            for name, field in cls.__fields__.items():
+                if name not in values and not field.required: values[name] = field.default
+            return cls.construct(fields_set, **values)
+        if tag == RAW_JSON:
+            raw = RawJSON.__new__(RawJSON)
+            raw._encoded = r.blob()
+            raw._path = tuple(self.value() for _ in range(r.varint()))
+            return raw
+        if tag == TREE: return LazyTree(r.bytes())
+        if tag in (LIST, TUPLE):
+            items = [self.value() for _ in range(r.varint())]
+            return items if tag == LIST else tuple(items)
+        if tag == DICT:
+            return {self.value(): self.value() for _ in range(r.varint())}
+        raise ValueError(f'Corrupted payload: unknown tag {tag}')
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encode core object (or any structure of them) into binary form
+    """
+    return Encoder().encode(obj)
+
+
+def loads(data: bytes, networks: NetworkResolver) -> Any:
+    """
+    Decode binary payload produced by dumps()
+    :param data: encoded payload
+    :param networks: mapping or function to resolve network by its id
+    """
+    return Decoder(data, networks).decode()
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Extra, AnyHttpUrl as URL
-from typing import Tuple, Callable, Any, Optional
+from typing import Tuple, Callable, Any, Optional, Iterator, Union
+from collections.abc import Mapping
 from async_property import async_property
 from datetime import datetime
 from enum import Enum
@@ -32,6 +33,52 @@ class Network(BaseModel):
     def unsubscribe(self, callback: Callable):
         self._subscribers.remove(callback)
 
+    def __repr_args__(self):
+        # Networks reference themselves through extra attributes (i.e. ID.origin)
+        return [('id', self.id)]
+
+
+class RawJSON(Mapping):
+    """
+    Read-only view of a raw JSON payload (or of an object nested in it), stored
+    in compact serialized form. Nothing is cached: every access decodes the
+    payload, use copy() to read several keys at once
+    """
+    __slots__ = ('_encoded', '_path')
+
+    def __init__(self, data: dict):
+        self._encoded = json.dumps(data, separators=(',', ':')).encode()
+        self._path = ()
+
+    def view(self, *path: Union[str, int]) -> 'RawJSON':
+        """
+        View of a nested object, sharing serialized payload with this one
+        """
+        raw = RawJSON.__new__(RawJSON)
+        raw._encoded, raw._path = self._encoded, self._path + path
+        return raw
+
+    def decode(self) -> dict:
+        data = json.loads(self._encoded)
+        for key in self._path: data = data[key]
+        return data
+
+    def copy(self) -> dict:
+        return self.decode()
+
+    def __getitem__(self, key: str) -> Any:
+        return self.decode()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.decode())
+
+    def __len__(self) -> int:
+        return len(self.decode())
+
+    def __repr__(self):
+        if not self._path: return f'RawJSON({self._encoded.decode()})'
+        return f'RawJSON({json.dumps(self.decode(), separators=(",", ":"))})'
+
 
 class ID(BaseModel):
     native_id: Optional[str]
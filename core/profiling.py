@@ -0,0 +1,143 @@
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from types import FrameType
+import threading
+import inspect
+import time
+import sys
+
+# Collapsed stack: frame labels from outermost to innermost
+Stack = Tuple[str, ...]
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+
+
+def is_coroutine(frame: FrameType) -> bool:
+    return bool(frame.f_code.co_flags & (inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE))
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for an asyncio event loop thread. Background thread
+    periodically samples loop thread's stack and attributes elapsed wall time
+    and loop thread's CPU time (where supported) to it. Time spent with a
+    coroutine on stack is also accounted to the outermost one (task's root)
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        # Stack -> number of samples / wall time / cpu time
+        self.samples: Dict[Stack, int] = Counter()
+        self.wall: Dict[Stack, float] = defaultdict(float)
+        self.cpu: Dict[Stack, float] = defaultdict(float)
+        # Labels of sampled frames which belong to coroutines
+        self.coroutine_labels = set()
+        self._thread = None
+        self._stopped = threading.Event()
+        try:
+            self._cpu_clock = time.pthread_getcpuclockid(self.thread_id)
+        except (AttributeError, OSError):
+            self._cpu_clock = None
+
+    def cpu_time(self) -> float:
+        if self._cpu_clock is None: return 0.0
+        return time.clock_gettime(self._cpu_clock)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def run(self):
+        last_wall, last_cpu = time.perf_counter(), self.cpu_time()
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None: break
+            stack = self.collect(frame)
+            wall, cpu = time.perf_counter(), self.cpu_time()
+            self.samples[stack] += 1
+            self.wall[stack] += wall - last_wall
+            self.cpu[stack] += cpu - last_cpu
+            last_wall, last_cpu = wall, cpu
+
+    def collect(self, frame: FrameType) -> Stack:
+        stack = []
+        while frame is not None:
+            label = frame_label(frame)
+            if is_coroutine(frame): self.coroutine_labels.add(label)
+            stack.append(label)
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def collapsed(self) -> List[str]:
+        """
+        Stacks in collapsed format (flamegraph.pl, speedscope, inferno),
+        weighted by microseconds of wall time
+        """
+        return [
+            f'{";".join(stack)} {round(wall * 1e6)}'
+            for stack, wall in self.wall.items() if wall > 0
+        ]
+
+    def write_collapsed(self, path: str):
+        with open(path, 'w') as f:
+            f.write('\n'.join(self.collapsed()) + '\n')
+
+    def coroutines(self) -> Dict[str, Tuple[float, float]]:
+        """
+        Root coroutine label -> (cpu time, wall time) it spent on the loop thread
+        """
+        result = defaultdict(lambda: (0.0, 0.0))
+        for stack in self.wall:
+            label = self.root_coroutine(stack)
+            if label is None: continue
+            cpu, wall = result[label]
+            result[label] = (cpu + self.cpu[stack], wall + self.wall[stack])
+        return dict(result)
+
+    def root_coroutine(self, stack: Stack) -> Optional[str]:
+        for label in stack:
+            if label in self.coroutine_labels: return label
+        return None
+
+    def report(self, top: int = 20) -> str:
+        """
+        Top-N functions by self & total wall time, plus per-coroutine times
+        """
+        own, total = defaultdict(float), defaultdict(float)
+        for stack, wall in self.wall.items():
+            if not stack: continue
+            own[stack[-1]] += wall
+            for label in set(stack):
+                total[label] += wall
+        overall = sum(self.wall.values())
+        lines = [f'Samples: {sum(self.samples.values())}, wall time: {overall:.3f}s', '']
+        overall = overall or 1.0
+        lines.append(f'{"self":>8} {"self %":>7} {"total":>8} {"total %":>7}  function')
+        for label, value in sorted(own.items(), key=lambda x: x[1], reverse=True)[:top]:
+            lines.append(
+                f'{value:8.3f} {value / overall:7.1%} '
+                f'{total[label]:8.3f} {total[label] / overall:7.1%}  {label}'
+            )
+        lines += ['', f'{"cpu":>8} {"wall":>8}  coroutine']
+        coroutines = sorted(self.coroutines().items(), key=lambda x: x[1][1], reverse=True)
+        for label, (cpu, wall) in coroutines[:top]:
+            lines.append(f'{cpu:8.3f} {wall:8.3f}  {label}')
+        return '\n'.join(lines)
@@ -1,13 +1,111 @@
-from networks.tg import Telegram
+"""
+Run the bot: python -m main --token <TOKEN> [options]
+
+With --profile, the event loop is sampled for a fixed window (or until a
+replayed update log is processed), then collapsed stacks (for flamegraphs)
+and a top-N hot function report are written.
+"""
+from networks import get_network_class
+from core.profiling import SamplingProfiler
+import argparse
 import asyncio
+import warnings
+import json
+import os
 
 
 async def callback(message):
     print('>>>', message.content)
 
 
-tg = Telegram(token='')
-tg.subscribe(callback)
-loop = asyncio.get_event_loop()
-loop.create_task(tg.setup())
-loop.run_forever()
+def parse_args(argv=None) -> argparse.Namespace:
+    # Network options are named after network fields and only set when given:
+    # everything else keeps defaults of the network itself
+    fields = get_network_class('telegram').__fields__
+
+    def default(name: str) -> str:
+        return f'(default: {fields[name].default})'
+
+    parser = argparse.ArgumentParser(prog='python -m main', description='Run the bot')
+    network = parser.add_argument_group('network', argument_default=argparse.SUPPRESS)
+    network.add_argument('--token', default=os.environ.get('BATYA_TOKEN', ''),
+                         help='Telegram bot token (default: $BATYA_TOKEN)')
+    network.add_argument('--mode', choices=('polling', 'webhook'), help=default('mode'))
+    network.add_argument('--webhook-url', help='public URL to register as webhook')
+    network.add_argument('--webhook-host', help=default('webhook_host'))
+    network.add_argument('--webhook-port', type=int, help=default('webhook_port'))
+    if 'BATYA_WEBHOOK_SECRET' in os.environ:
+        network.set_defaults(webhook_secret=os.environ['BATYA_WEBHOOK_SECRET'])
+    network.add_argument('--webhook-secret',
+                         help='webhook secret token (default: $BATYA_WEBHOOK_SECRET, '
+                              'random if not set)')
+    network.add_argument('--workers', type=int,
+                         help=f'max concurrent subscriber callbacks, 0 for unlimited {default("workers")}')
+    network.add_argument('--prefetch', dest='prefetch_batches', type=int,
+                         help=f'number of update batches fetched ahead of processing '
+                              f'{default("prefetch_batches")}')
+    network.add_argument('--compact', dest='compact_mode', action='store_true',
+                         help='compact memory mode')
+    network.add_argument('--dedup-size', type=int,
+                         help=f'number of recent update ids kept for deduplication {default("dedup_size")}')
+    network.add_argument('--dedup-window', type=float,
+                         help=f'seconds an update id is kept for deduplication {default("dedup_window")}')
+    profiling = parser.add_argument_group('profiling')
+    profiling.add_argument('--profile', type=float, metavar='SECONDS',
+                           help='profile the running bot for given number of seconds')
+    profiling.add_argument('--replay', metavar='FILE',
+                           help='profile processing of an update log (JSON lines) '
+                                'instead of live updates')
+    profiling.add_argument('--profile-output', default='profile',
+                           help='output prefix: <prefix>.collapsed, <prefix>.txt')
+    profiling.add_argument('--profile-interval', type=float, default=0.005,
+                           help='sampling interval in seconds')
+    profiling.add_argument('--top', type=int, default=20, help='hot functions to report')
+    return parser.parse_args(argv)
+
+
+def make_network(args: argparse.Namespace):
+    Telegram = get_network_class('telegram')
+    options = {k: v for k, v in vars(args).items() if k in Telegram.__fields__}
+    tg = Telegram(**options)
+    tg.subscribe(callback)
+    return tg
+
+
+async def replay(tg, path: str):
+    with open(path) as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    # Same batch size as polling under sustained load
+    for i in range(0, len(updates), tg.poll_limit_max):
+        tg.process_updates(updates[i:i + tg.poll_limit_max])
+        # Let subscriber callbacks run, a failed one doesn't stop the replay
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception): warnings.warn(f'[!] Callback failed: {result!r}')
+
+
+async def run(args: argparse.Namespace):
+    tg = make_network(args)
+    if args.profile is None and args.replay is None:
+        await tg.setup()
+        await asyncio.Event().wait()
+    profiler = SamplingProfiler(interval=args.profile_interval)
+    try:
+        with profiler:
+            if args.replay is not None:
+                await replay(tg, args.replay)
+            else:
+                await tg.setup()
+                await asyncio.sleep(args.profile)
+    finally:
+        # Whatever was sampled is written, even if the bot has failed
+        profiler.write_collapsed(f'{args.profile_output}.collapsed')
+        report = profiler.report(args.top)
+        with open(f'{args.profile_output}.txt', 'w') as f:
+            f.write(report + '\n')
+        print(report)
+        if tg.http is not None: await tg.http.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,34 @@
+from importlib import import_module
+from typing import Dict, Tuple, Type
+
+# Network id -> (module path, class name), modules are imported on first use
+REGISTRY: Dict[str, Tuple[str, str]] = {
+    'telegram': ('networks.tg', 'Telegram'),
+}
+
+
+def register(id: str, module: str, name: str):
+    """
+    Register network implementation without importing it
+    :param id: network id (same as Network.id)
+    :param module: full module path, i.e. 'networks.tg'
+    :param name: class name inside the module
+    """
+    REGISTRY[id] = (module, name)
+
+
+def get_network_class(id: str) -> Type:
+    """
+    Import (on first call) and return network class by its id
+    """
+    if id not in REGISTRY:
+        raise KeyError(f'Unknown network: \'{id}\'. Available: {set(REGISTRY)}')
+    module, name = REGISTRY[id]
+    return getattr(import_module(module), name)
+
+
+__all__ = [
+    'REGISTRY',
+    'register',
+    'get_network_class',
+]
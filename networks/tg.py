@@ -1,57 +1,171 @@
-from core.attachments.general import Forward
-from core.attachments import *
-from core import *
+from core.attachments.general import Forward, Document, DocumentType
+from core.attachments.text import Text, make_soup
+from core import Network, RawJSON, ID, User, ChatType, Chat, Message
+from core import codec
 
 from async_property import async_property
-from collections import defaultdict
-from aiohttp import ClientSession
-from typing import Optional, List
-from bs4 import BeautifulSoup
+from collections import defaultdict, deque
+from typing import Optional, List, Callable, ClassVar, TYPE_CHECKING
 import warnings
+import secrets
 import asyncio
+import hmac
+import time
+
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
 
 
 class Telegram(Network):
     id = 'telegram'
     token: str
+    prefetch_batches: int = 2
+    # getUpdates limit grows from start to max on full batches (100 is Telegram's cap)
+    poll_limit_start: int = 100
+    poll_limit_max: int = 100
+    # getUpdates long polling timeout (seconds)
+    poll_timeout: int = 30
+    # Compact mode: keep only fields needed for merging instead of raw payloads
+    compact_mode: bool = False
+    # Keep raw payload (as lazily-decoded JSON) even in compact mode
+    keep_raw: bool = False
+    # Update delivery: 'polling' or 'webhook'
+    mode: str = 'polling'
+    webhook_url: Optional[str] = None
+    webhook_host: str = '0.0.0.0'
+    webhook_port: int = 8443
+    # Secret Telegram sends with every webhook request, generated if not set
+    webhook_secret: Optional[str] = None
+    # Max number of concurrently running subscriber callbacks, 0 for unlimited
+    workers: int = 0
+    # Recently seen update ids kept for deduplication: max count & max age (seconds)
+    dedup_size: int = 10000
+    dedup_window: float = 3600
 
     def __init__(self, **data):
         super().__init__(**data)
-        self.http = ClientSession()
+        self.http = None
+        self.limiter = None
         self.pid = ID(native_id=None, origin=self)
+        self.files = TgFileResolver(self)
+        self.dedup = TgUpdateFilter(self.dedup_size, self.dedup_window)
 
     def notify(self, data):
         for coro in self._subscribers:
-            asyncio.ensure_future(coro(data))
+            asyncio.ensure_future(self.dispatch(coro, data))
+
+    async def dispatch(self, callback: Callable, data):
+        if not self.workers: return await callback(data)
+        if self.limiter is None: self.limiter = asyncio.Semaphore(self.workers)
+        async with self.limiter:
+            await callback(data)
+
+    def session(self) -> 'ClientSession':
+        # aiohttp is imported on first HTTP call
+        if self.http is None:
+            from aiohttp import ClientSession
+            self.http = ClientSession()
+        return self.http
 
     async def request(self, method, data=None):
         url = f'https://api.telegram.org/bot{self.token}/{method}'
-        res = await self.http.post(url, json=data or {})
+        res = await self.session().post(url, json=data or {})
         data = await res.json()
         return data.get('result')
 
     async def setup(self):
         data = await self.request('getMe')
         assert data is not None, 'API Authentication Failed'
-        asyncio.ensure_future(self.polling_loop())
+        if self.mode == 'webhook':
+            await self.setup_webhook()
+        else:
+            # getUpdates doesn't work while a webhook (i.e. from previous run) is set
+            data = await self.request('deleteWebhook')
+            assert data is not None, 'Failed to delete webhook'
+            asyncio.ensure_future(self.polling_loop())
+
+    async def setup_webhook(self):
+        from aiohttp import web
+        assert self.webhook_url is not None, 'Webhook URL is not set'
+        if self.webhook_secret is None: self.webhook_secret = secrets.token_urlsafe(32)
+
+        async def handler(request: web.Request):
+            secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(secret, self.webhook_secret):
+                return web.Response(status=403)
+            try:
+                update = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            if not isinstance(update, dict) or 'update_id' not in update:
+                return web.Response(status=400)
+            self.process_updates([update])
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post('/', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, self.webhook_host, self.webhook_port).start()
+        data = await self.request('setWebhook', {
+            'url': self.webhook_url,
+            'secret_token': self.webhook_secret,
+        })
+        assert data is not None, 'Failed to set webhook'
 
     async def polling_loop(self):
         loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(maxsize=self.prefetch_batches)
+        async with self.session():
+            fetcher = asyncio.ensure_future(self.fetch_loop(queue))
+            try:
+                while loop.is_running():
+                    get = asyncio.ensure_future(queue.get())
+                    await asyncio.wait({get, fetcher}, return_when=asyncio.FIRST_COMPLETED)
+                    if not get.done():
+                        # Fetcher has failed (or was cancelled): propagate its error
+                        get.cancel()
+                        fetcher.result()
+                        return
+                    self.process_updates(get.result())
+            finally:
+                fetcher.cancel()
+
+    async def fetch_loop(self, queue: asyncio.Queue):
+        """
+        Fetch update batches ahead of processing. Queue size bounds the number of
+        prefetched batches, offset only moves past batches already put into queue
+        """
         offset = 0
-        async with self.http:
-            while loop.is_running():
-                data = await self.request('getUpdates', {'offset': offset})
-                if not data: continue
-                offset = max((x['update_id'] for x in data)) + 1
-                groups = self.groupify_updates(data)
-                if 'message' in groups: self.process_messages(groups.pop('message'))
-                if groups: warnings.warn(f'[!] Unsupported updates: {groups.keys()}')
+        limit = self.poll_limit_start
+        while True:
+            data = await self.request('getUpdates', {
+                'offset': offset,
+                'limit': limit,
+                'timeout': self.poll_timeout,
+            })
+            limit = self.adapt_limit(limit, len(data or ()))
+            if not data: continue
+            await queue.put(data)
+            offset = max((x['update_id'] for x in data)) + 1
+
+    def adapt_limit(self, limit: int, received: int) -> int:
+        # Full batch -> more updates are probably waiting, grow limit. Limit is
+        # never shrunk: smaller batches only add round-trips when a burst comes
+        if received >= limit: return min(limit * 2, self.poll_limit_max)
+        return limit
+
+    def process_updates(self, updates):
+        updates = self.dedup.filter(updates)
+        if not updates: return
+        groups = self.groupify_updates(updates)
+        if 'message' in groups: self.process_messages(groups.pop('message'))
+        if groups: warnings.warn(f'[!] Unsupported updates: {groups.keys()}')
 
     def groupify_updates(self, updates):
         groups = defaultdict(list)
         for update in updates:
-            update.pop('update_id')
-            kind = next(iter(update.keys()))
+            kind = next(x for x in update if x != 'update_id')
             groups[kind].append(update)
         return groups
 
@@ -84,9 +198,7 @@ class Telegram(Network):
                 prev_message = message
             elif self.is_forward(message) and self.can_merge(prev_message, message):
                 if self.is_forward(prev_message):
-                    forward_holder = TgMessage.from_json(
-                        self.pid, prev_message.id.native_obj, parse_forward=False
-                    ).copy(update={'content': []})
+                    forward_holder = prev_message.unforwarded(self.pid)
                 else:
                     forward_holder = prev_message
                 forward_attachment = Forward(id=self.pid.clone())
@@ -97,25 +209,19 @@ class Telegram(Network):
 
     def is_forward(self, message):
         if message is None: return False
-        return 'forward_date' in message.id.native_obj
+        return message._forward_date is not None
 
     def can_merge_strict(self, a, b) -> bool:
         if a is None or b is None: return False
         if a.when != b.when: return False
         if a.sender.id != b.sender.id: return False
-        mgid_a = a.id.native_obj.get('media_group_id', 0)
-        mgid_b = b.id.native_obj.get('media_group_id', 1)
-        if mgid_a == mgid_b: return True
-        return False
+        if a._media_group_id is None: return False
+        return a._media_group_id == b._media_group_id
 
     def can_merge(self, a, b) -> bool:
         if a is None or b is None: return False
-        when_a = a.id.native_obj['date']
-        when_b = b.id.native_obj['date']
-        if when_a != when_b: return False
-        uid_a = a.id.native_obj['from']['id']
-        uid_b = b.id.native_obj['from']['id']
-        if uid_a != uid_b: return False
+        if a._date != b._date: return False
+        if a._from_id != b._from_id: return False
         if self.is_forward(b): return True
         warnings.warn(f'[!] Merge check confusion:\n{a}\n{b}')
         return False
@@ -127,9 +233,22 @@ class Telegram(Network):
             sender=b.sender,
             chat=b.chat,
             content=a.content + b.content,
+            **b.slots(),
         )
 
 
+def raw_payload(pid: ID, data: dict, parent: Optional[RawJSON] = None, *path):
+    """
+    Raw payload to be stored in ID.native_obj, depending on network's memory mode.
+    Objects nested in a message (sender, chat, file) get a view into message's
+    raw payload instead of a serialized copy of their own
+    """
+    if not pid.origin.compact_mode: return data
+    if not pid.origin.keep_raw: return None
+    if parent is not None: return parent.view(*path)
+    return RawJSON(data)
+
+
 # TODO: LAZY ENRICHMENT
 class TgUser(User):
     _first_name: Optional[str]
@@ -137,10 +256,10 @@ class TgUser(User):
     _username: Optional[str]
 
     @classmethod
-    def from_json(cls, pid, data):
+    def from_json(cls, pid, data, raw=None, *path):
         if data is None: return None
         return TgUser(
-            id=pid.clone(data['id'], data),
+            id=pid.clone(data['id'], raw_payload(pid, data, raw, *path)),
             is_bot=data['is_bot'],
             _first_name=data.get('first_name'),
             _last_name=data.get('last_name'),
@@ -177,39 +296,248 @@ class TgUser(User):
 
 class TgChat(Chat):
     @classmethod
-    def from_json(cls, pid, data):
+    def from_json(cls, pid, data, raw=None, *path):
         return TgChat(
-            id=pid.clone(data['id'], data),
+            id=pid.clone(data['id'], raw_payload(pid, data, raw, *path)),
             type=ChatType.USER if data['type'] == 'private' else ChatType.GROUP,
         )
 
 
 class TgMessage(Message):
+    # Fields used for merging, extracted from the original (not forwarded) payload
+    _date: int
+    _from_id: Optional[int]
+    _media_group_id: Optional[str]
+    _forward_date: Optional[int]
+    # Forwarder's (message_id, date, sender, chat), kept when raw payload is not
+    _header: Optional[tuple]
+
     @classmethod
     def from_json(cls, pid, data, parse_forward=True):
         data_copy = data.copy()
+        slots = {
+            '_date': data['date'],
+            '_from_id': (data.get('from') or {}).get('id'),
+            '_media_group_id': data.get('media_group_id'),
+            '_forward_date': data.get('forward_date'),
+            '_header': None,
+        }
+        raw = raw_payload(pid, data_copy)
+        # Keys of sender & chat in the raw payload
+        from_key, chat_key = 'from', 'chat'
         if parse_forward and 'forward_date' in data:
+            if raw is None:
+                slots['_header'] = (
+                    data['message_id'],
+                    data['date'],
+                    TgUser.from_json(pid, data.get('from')),
+                    TgChat.from_json(pid, data['chat']),
+                )
+            from_key = 'forward_from'
+            if 'forward_from_chat' in data: chat_key = 'forward_from_chat'
             data['date'] = data['forward_date']
             data['from'] = data.get('forward_from')
-            data['chat'] = data.get('forward_from_chat', data['chat'])
+            data['chat'] = data[chat_key]
             data['message_id'] = data.get('forward_from_message_id', data['message_id'])
             # TODO: MORE RESEARCH
+        # Only the message itself keeps raw payload (if any), the rest refer to it
+        parent = raw if isinstance(raw, RawJSON) else None
         return TgMessage(
-            id=pid.clone(data['message_id'], data_copy),
+            id=pid.clone(data['message_id'], raw),
             when=data['date'],
-            sender=TgUser.from_json(pid, data['from']),
-            chat=TgChat.from_json(pid, data['chat']),
-            content=TgMessage.parse_content(pid, data),
+            sender=TgUser.from_json(pid, data['from'], parent, from_key),
+            chat=TgChat.from_json(pid, data['chat'], parent, chat_key),
+            content=TgMessage.parse_content(pid, data, parent),
+            **slots,
+        )
+
+    def slots(self) -> dict:
+        return {
+            '_date': self._date,
+            '_from_id': self._from_id,
+            '_media_group_id': self._media_group_id,
+            '_forward_date': self._forward_date,
+            '_header': self._header,
+        }
+
+    def unforwarded(self, pid: ID) -> 'TgMessage':
+        """
+        Empty message from the forwarder's point of view (used as forward holder)
+        """
+        if self.id.native_obj is not None:
+            data = self.id.native_obj.copy()
+            message = TgMessage.from_json(pid, data, parse_forward=False)
+            return message.copy(update={'content': []})
+        message_id, when, sender, chat = self._header
+        return TgMessage(
+            id=pid.clone(message_id),
+            when=when,
+            sender=sender,
+            chat=chat,
+            content=[],
+            **self.slots(),
         )
 
     @staticmethod
-    def parse_content(pid: ID, data: dict):
+    def parse_content(pid: ID, data: dict, raw: Optional[RawJSON] = None):
         content = []
+        # Caption of a recognized media is kept in Document.caption only
+        document = TgDocument.from_message(pid, data, raw)
         if 'text' in data: content.append(TgText.from_json(pid, data))
-        elif 'caption' in data: content.append(TgText.from_string(pid, data['caption']))
+        elif 'caption' in data and document is None:
+            content.append(TgText.from_string(pid, data['caption']))
+        if document is not None: content.append(document)
         return tuple(content)
 
 
+class TgDocument(Document):
+    # Message keys in order of priority (animations also come with 'document')
+    KINDS: ClassVar[tuple] = ('photo', 'animation', 'video', 'video_note', 'voice', 'audio', 'sticker', 'document')
+    MIME_TYPES: ClassVar[dict] = {
+        'image/gif': DocumentType.GIF,
+        'image': DocumentType.IMAGE,
+        'audio': DocumentType.AUDIO,
+        'video': DocumentType.VIDEO,
+    }
+    _file_id: str
+
+    @classmethod
+    def from_message(cls, pid, data, raw=None) -> Optional['TgDocument']:
+        kind = next((x for x in cls.KINDS if x in data), None)
+        if kind is None: return None
+        file, path = data[kind], (kind,)
+        if kind == 'photo':
+            # Only the largest PhotoSize is kept
+            index = max(range(len(file)), key=lambda i: (
+                file[i].get('file_size', 0), file[i]['width'] * file[i]['height'],
+            ))
+            file, path = file[index], (kind, index)
+        return TgDocument(
+            id=pid.clone(file['file_unique_id'], raw_payload(pid, file, raw, *path)),
+            type=cls.document_type(kind, file),
+            filename=file.get('file_name'),
+            caption=data.get('caption'),
+            size=file.get('file_size', -1),
+            _file_id=file['file_id'],
+        )
+
+    @classmethod
+    def document_type(cls, kind: str, file: dict) -> DocumentType:
+        if kind == 'photo': return DocumentType.IMAGE
+        if kind == 'animation': return DocumentType.GIF
+        if kind in ('video', 'video_note'): return DocumentType.VIDEO
+        if kind in ('voice', 'audio'): return DocumentType.AUDIO
+        if kind == 'sticker':
+            return DocumentType.VIDEO if file.get('is_video') else DocumentType.IMAGE
+        mime = file.get('mime_type', '')
+        if mime in cls.MIME_TYPES: return cls.MIME_TYPES[mime]
+        return cls.MIME_TYPES.get(mime.split('/')[0], DocumentType.UNKNOWN)
+
+    async def resolve_url(self) -> str:
+        """
+        Resolved via getFile on first call, valid for one hour. Not stored in
+        url, as it contains the bot token and expires
+        """
+        return await self.id.origin.files.resolve(self._file_id)
+
+    async def download(self, offset: int = 0, limit: int = -1) -> bytes:
+        url = await self.resolve_url()
+        headers = {}
+        if offset or limit != -1:
+            end = '' if limit == -1 else offset + limit - 1
+            headers['Range'] = f'bytes={offset}-{end}'
+        async with self.id.origin.session().get(url, headers=headers) as res:
+            res.raise_for_status()
+            return await res.read()
+
+
+class TgUpdateFilter:
+    """
+    Drops updates which were already seen (webhook redeliveries, overlapping
+    polling batches). Keeps a bounded ring buffer of recent update ids, ids
+    leave it after `window` seconds or when `size` newer ids are stored
+    """
+
+    def __init__(self, size: int, window: float):
+        self.size = size
+        self.window = window
+        # (arrival time, update_id) in arrival order + set for lookups
+        self.recent = deque()
+        self.seen = set()
+        # Number of dropped duplicates
+        self.dropped = 0
+
+    def filter(self, updates: list) -> list:
+        now = time.monotonic()
+        self.expire(now)
+        result = []
+        for update in updates:
+            uid = update['update_id']
+            if uid in self.seen:
+                self.dropped += 1
+                continue
+            self.seen.add(uid)
+            self.recent.append((now, uid))
+            result.append(update)
+        while len(self.recent) > self.size:
+            self.seen.discard(self.recent.popleft()[1])
+        return result
+
+    def expire(self, now: float):
+        while self.recent and self.recent[0][0] <= now - self.window:
+            self.seen.discard(self.recent.popleft()[1])
+
+
+class TgFileResolver:
+    """
+    Resolves file_id -> download URL via getFile. URLs are cached for TTL
+    (Telegram guarantees file_path validity for one hour), concurrent lookups
+    of the same file_id share a single request
+    """
+    TTL = 3600
+    MAX_SIZE = 10000
+
+    def __init__(self, network: Telegram, ttl: float = TTL, max_size: int = MAX_SIZE):
+        self.network = network
+        self.ttl = ttl
+        self.max_size = max_size
+        # file_id -> (expiration time, url)
+        self.cache = {}
+        # file_id -> future of in-flight getFile request
+        self.pending = {}
+
+    async def resolve(self, file_id: str) -> str:
+        cached = self.cache.get(file_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        if file_id not in self.pending:
+            future = asyncio.ensure_future(self.fetch(file_id))
+            future.add_done_callback(lambda _: self.pending.pop(file_id, None))
+            self.pending[file_id] = future
+        # Shield: one cancelled waiter must not cancel the request for others
+        return await asyncio.shield(self.pending[file_id])
+
+    async def fetch(self, file_id: str) -> str:
+        # Expiration is counted from the request start to stay on the safe side
+        expires = time.monotonic() + self.ttl
+        data = await self.network.request('getFile', {'file_id': file_id})
+        if data is None or 'file_path' not in data:
+            raise RuntimeError(f'Failed to resolve file: {file_id}')
+        url = f'https://api.telegram.org/file/bot{self.network.token}/{data["file_path"]}'
+        self.store(file_id, expires, url)
+        return url
+
+    def store(self, file_id: str, expires: float, url: str):
+        self.cache.pop(file_id, None)
+        if len(self.cache) >= self.max_size:
+            now = time.monotonic()
+            self.cache = {k: v for k, v in self.cache.items() if v[0] > now}
+        while len(self.cache) >= self.max_size:
+            # Evict oldest entry (dicts preserve insertion order)
+            del self.cache[next(iter(self.cache))]
+        self.cache[file_id] = (expires, url)
+
+
 class TgText(Text):
     @classmethod
     def from_json(cls, pid, data):
@@ -235,7 +563,7 @@ class TgTextParser:
     def __init__(self, pid: ID, text: str, entities: list):
         self.pid = pid
         self.text = text
-        self.soup = BeautifulSoup('<root></root>', 'lxml')
+        self.soup = make_soup('<root></root>')
         self.entities = []
         for x in entities:
             e = x.copy()
@@ -320,3 +648,6 @@ class TgTextParser:
         self.soup.root.replace_with(self.build(root))
         self.soup.root.unwrap()
         return TgText(id=self.pid.clone(), tree=self.soup)
+
+
+codec.register(TgUser, TgChat, TgMessage, TgDocument, TgText)
@@ -0,0 +1,272 @@
+from core.attachments.general import Forward, Document, DocumentType
+from core.attachments.text import Text
+from core.general import ChatType
+from core.codec import LazyTree, MAGIC, VERSION, Writer
+from core import codec, ID, RawJSON
+from networks.tg import Telegram, TgUser, TgChat, TgMessage, TgDocument, TgText
+from datetime import datetime, timezone, timedelta
+import pytest
+import copy
+import sys
+
+USER = {'id': 1001, 'is_bot': False, 'first_name': 'James', 'last_name': 'Bond', 'username': 'jb'}
+FORWARDER = {'id': 2002, 'is_bot': False, 'first_name': 'Q'}
+CHAT = {'id': -100500, 'title': 'Test chat', 'type': 'supergroup'}
+MODES = {
+    'default': {},
+    'compact': {'compact_mode': True},
+    'keep_raw': {'compact_mode': True, 'keep_raw': True},
+}
+
+
+def make_network(mode: str = 'default') -> Telegram:
+    return Telegram(token='', **MODES[mode])
+
+
+def round_trip(tg: Telegram, obj):
+    return codec.loads(codec.dumps(obj), {tg.id: tg})
+
+
+def message_json(message_id: int = 1, **extra) -> dict:
+    data = {
+        'message_id': message_id,
+        'date': 1600000000,
+        'from': dict(USER),
+        'chat': dict(CHAT),
+        'text': 'Hello, world! See docs',
+        'entities': [
+            {'type': 'bold', 'offset': 0, 'length': 5},
+            {'type': 'text_link', 'offset': 18, 'length': 4, 'url': 'https://example.com'},
+            {'type': 'hashtag', 'offset': 7, 'length': 5},
+        ],
+    }
+    data.update(extra)
+    return data
+
+
+def assert_ids_equal(a: ID, b: ID):
+    assert type(b) is ID
+    assert (b.native_id, b.origin.id) == (a.native_id, a.origin.id)
+    if a.native_obj is None:
+        assert b.native_obj is None
+    else:
+        assert type(b.native_obj) is type(a.native_obj)
+        assert dict(b.native_obj) == dict(a.native_obj)
+
+
+def assert_users_equal(a: TgUser, b: TgUser):
+    assert type(b) is TgUser
+    assert_ids_equal(a.id, b.id)
+    assert (b.is_bot, b._first_name, b._last_name, b._username) == \
+           (a.is_bot, a._first_name, a._last_name, a._username)
+
+
+def assert_chats_equal(a: TgChat, b: TgChat):
+    assert type(b) is TgChat
+    assert_ids_equal(a.id, b.id)
+    assert b.type is a.type
+
+
+def assert_messages_equal(a: TgMessage, b: TgMessage):
+    assert type(b) is type(a)
+    assert_ids_equal(a.id, b.id)
+    assert b.when == a.when
+    assert_users_equal(a.sender, b.sender)
+    assert_chats_equal(a.chat, b.chat)
+    a_slots, b_slots = a.slots(), b.slots()
+    a_header, b_header = a_slots.pop('_header'), b_slots.pop('_header')
+    assert b_slots == a_slots
+    if a_header is None:
+        assert b_header is None
+    else:
+        assert b_header[:2] == a_header[:2]
+        assert_users_equal(a_header[2], b_header[2])
+        assert_chats_equal(a_header[3], b_header[3])
+    assert len(b.content) == len(a.content)
+    for x, y in zip(a.content, b.content):
+        assert type(y) is type(x)
+        if isinstance(x, Text): assert str(y.tree) == str(x.tree)
+        if isinstance(x, TgDocument):
+            assert (y._file_id, y.type, y.size, y.caption) == (x._file_id, x.type, x.size, x.caption)
+        if isinstance(x, Forward):
+            for m, n in zip(x.messages, y.messages): assert_messages_equal(m, n)
+
+
+def test_id():
+    tg = make_network()
+    pid = tg.pid.clone(42, {'a': [1, -2, 3.5, None, True]})
+    assert_ids_equal(pid, round_trip(tg, pid))
+
+
+def test_network_resolver():
+    tg = make_network()
+    data = codec.dumps(tg.pid.clone(1))
+    assert codec.loads(data, lambda x: tg).origin is tg
+    with pytest.raises(KeyError):
+        codec.loads(data, {})
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_user_and_chat(mode):
+    tg = make_network(mode)
+    user = TgUser.from_json(tg.pid, dict(USER))
+    chat = TgChat.from_json(tg.pid, dict(CHAT))
+    assert_users_equal(user, round_trip(tg, user))
+    assert_chats_equal(chat, round_trip(tg, chat))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_message(mode):
+    tg = make_network(mode)
+    message = TgMessage.from_json(tg.pid, message_json())
+    decoded = round_trip(tg, message)
+    assert_messages_equal(message, decoded)
+    if mode == 'keep_raw':
+        assert isinstance(decoded.id.native_obj, RawJSON)
+        # Sender & chat views share message's payload, which is written once
+        assert decoded.sender.id.native_obj._encoded is decoded.id.native_obj._encoded
+        assert codec.dumps(message).count(message.id.native_obj._encoded) == 1
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_forwarded_message(mode):
+    tg = make_network(mode)
+    data = message_json(forward_date=1500000000, forward_from=dict(FORWARDER))
+    message = TgMessage.from_json(tg.pid, data)
+    assert (message._header is not None) == (mode == 'compact')
+    assert_messages_equal(message, round_trip(tg, message))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_forward(mode):
+    tg = make_network(mode)
+    messages = tuple(TgMessage.from_json(tg.pid, message_json(i)) for i in range(3))
+    forward = Forward(id=tg.pid.clone(), messages=messages)
+    decoded = round_trip(tg, forward)
+    assert type(decoded) is Forward
+    assert len(decoded.messages) == 3
+    for a, b in zip(messages, decoded.messages): assert_messages_equal(a, b)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_document(mode):
+    tg = make_network(mode)
+    photo = [
+        {'file_id': 'small', 'file_unique_id': 's', 'width': 90, 'height': 90, 'file_size': 100},
+        {'file_id': 'large', 'file_unique_id': 'l', 'width': 800, 'height': 600, 'file_size': 5000},
+    ]
+    data = message_json(photo=photo, caption='Look')
+    del data['text']
+    message = TgMessage.from_json(tg.pid, data)
+    document = next(x for x in message.content if isinstance(x, TgDocument))
+    decoded = round_trip(tg, document)
+    assert type(decoded) is TgDocument
+    assert (decoded._file_id, decoded.type, decoded.size) == ('large', DocumentType.IMAGE, 5000)
+    assert_ids_equal(document.id, decoded.id)
+    assert_messages_equal(message, round_trip(tg, message))
+
+
+def test_core_document():
+    tg = make_network()
+    document = Document(id=tg.pid.clone(7), type=DocumentType.GIF, filename='a.gif', size=10)
+    decoded = round_trip(tg, document)
+    assert type(decoded) is Document
+    assert (decoded.type, decoded.filename, decoded.size, decoded.url) == (DocumentType.GIF, 'a.gif', 10, None)
+
+
+def test_text_tree():
+    tg = make_network()
+    text = TgText.from_json(tg.pid, message_json())
+    decoded = round_trip(tg, text)
+    assert type(decoded) is TgText
+    assert isinstance(decoded.tree, LazyTree)
+    assert decoded.tree._soup is None
+    assert str(decoded.tree) == str(text.tree)
+    link = decoded.tree.find('a')
+    assert link.attrs['href'] == 'https://example.com'
+    span = decoded.tree.find('span')
+    assert span.attrs == text.tree.find('span').attrs
+    # Re-encoding reuses flat data
+    assert codec.dumps(decoded) == codec.dumps(text)
+
+
+def test_text_tree_multivalued_attrs():
+    tg = make_network()
+    text = Text.from_html(tg.pid, '<p class="a b" id="x">one <i>two</i></p>')
+    decoded = round_trip(tg, text)
+    assert decoded.tree.p.attrs == {'class': ['a', 'b'], 'id': 'x'}
+    assert str(decoded.tree) == str(text.tree)
+
+
+def test_lazy_tree_copy():
+    tg = make_network()
+    tree = round_trip(tg, Text.from_string(tg.pid, 'hi')).tree
+    for duplicate in (copy.copy(tree), copy.deepcopy(tree)):
+        assert isinstance(duplicate, LazyTree)
+        assert str(duplicate) == str(tree)
+
+
+@pytest.mark.parametrize('value', [
+    datetime(2020, 5, 17, 12, 30, 15, 123456, tzinfo=timezone.utc),
+    datetime(1960, 1, 1, tzinfo=timezone.utc),
+    datetime(2020, 5, 17, 12, 30, tzinfo=timezone(timedelta(hours=3))),
+    datetime(2020, 5, 17, 12, 30),
+])
+def test_datetime(value):
+    decoded = round_trip(make_network(), value)
+    assert decoded == value
+    assert decoded.utcoffset() == value.utcoffset()
+
+
+@pytest.mark.parametrize('value', [DocumentType.VIDEO, ChatType.GROUP])
+def test_enum(value):
+    assert round_trip(make_network(), value) is value
+
+
+def test_primitives():
+    value = {'a': [0, -1, 2 ** 70, -2 ** 70, 1.5, 'str', b'bytes', None, True, False], 3: ('x', 'x')}
+    assert round_trip(make_network(), value) == value
+
+
+def test_bad_magic():
+    with pytest.raises(ValueError, match='Not a binary-encoded payload'):
+        codec.loads(b'\x80\x04pickle', {})
+
+
+def test_bad_version():
+    data = codec.dumps(None)
+    w = Writer()
+    w.buf += MAGIC
+    w.varint(VERSION + 1)
+    with pytest.raises(ValueError, match='Unsupported payload version'):
+        codec.loads(bytes(w.buf) + data[len(w.buf):], {})
+
+
+def test_unregistered_class_is_not_imported():
+    w = Writer()
+    w.buf += MAGIC
+    w.varint(VERSION)
+    w.buf.append(codec.MODEL)
+    w.symbol('definitely_not_imported_module:Model')
+    w.varint(0)
+    with pytest.raises(ValueError, match='Unknown class'):
+        codec.loads(bytes(w.buf), {})
+    assert 'definitely_not_imported_module' not in sys.modules
+
+
+def test_unregistered_class_is_not_encoded():
+    class Custom(Text):
+        pass
+
+    tg = make_network()
+    with pytest.raises(TypeError, match='not registered'):
+        codec.dumps(Custom(id=tg.pid.clone(), tree=None))
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_truncated_payload(mode):
+    tg = make_network(mode)
+    data = codec.dumps((TgMessage.from_json(tg.pid, message_json()), 1.5))
+    for size in range(len(MAGIC), len(data)):
+        with pytest.raises(ValueError, match='Corrupted payload'):
+            codec.loads(data[:size], {tg.id: tg})
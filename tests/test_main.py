@@ -0,0 +1,53 @@
+from networks.tg import Telegram
+import warnings
+import asyncio
+import json
+import main
+
+
+def test_unset_options_keep_network_defaults():
+    args = main.parse_args(['--token', 'x'])
+    tg = main.make_network(args)
+    for name, field in Telegram.__fields__.items():
+        # Secret may come from $BATYA_WEBHOOK_SECRET
+        if name in ('id', 'token', 'webhook_secret'): continue
+        assert getattr(tg, name) == field.default, name
+
+
+def test_options_are_passed_to_network():
+    args = main.parse_args([
+        '--token', 'x', '--mode', 'webhook', '--webhook-port', '80', '--workers', '4',
+        '--prefetch', '3', '--compact', '--dedup-size', '10', '--dedup-window', '1.5',
+    ])
+    tg = main.make_network(args)
+    assert (tg.token, tg.mode, tg.webhook_port, tg.workers) == ('x', 'webhook', 80, 4)
+    assert (tg.prefetch_batches, tg.compact_mode, tg.dedup_size, tg.dedup_window) == (3, True, 10, 1.5)
+    assert args.profile is None and args.top == 20
+
+
+def test_replay_writes_profile_when_callback_fails(tmp_path, monkeypatch):
+    calls = []
+
+    async def callback(message):
+        calls.append(message.id.native_id)
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(main, 'callback', callback)
+    log = tmp_path / 'updates.jsonl'
+    message = {
+        'date': 1600000000, 'text': 'hi',
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'James'}, 'chat': {'id': 1, 'type': 'private'},
+    }
+    log.write_text('\n'.join(
+        json.dumps({'update_id': i, 'message': dict(message, message_id=i, date=message['date'] + i)})
+        for i in range(1, 4)
+    ))
+    prefix = tmp_path / 'profile'
+    args = main.parse_args(['--replay', str(log), '--profile-output', str(prefix)])
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        asyncio.run(main.run(args))
+    assert calls == ['1', '2', '3']
+    assert sum('Callback failed' in str(x.message) for x in caught) == 3
+    assert (tmp_path / 'profile.txt').read_text().startswith('Samples:')
+    assert (tmp_path / 'profile.collapsed').exists()
@@ -0,0 +1,65 @@
+from core.profiling import SamplingProfiler
+import asyncio
+import sys
+import time
+
+
+def make_profiler() -> SamplingProfiler:
+    profiler = SamplingProfiler()
+    for stack, wall, cpu in [
+        (('main', 'loop', 'handler', 'parse'), 0.3, 0.3),
+        (('main', 'loop', 'handler'), 0.1, 0.05),
+        (('main', 'loop', 'select'), 0.6, 0.0),
+    ]:
+        profiler.samples[stack] += 1
+        profiler.wall[stack] += wall
+        profiler.cpu[stack] += cpu
+    profiler.coroutine_labels.add('handler')
+    return profiler
+
+
+def test_collapsed():
+    profiler = make_profiler()
+    profiler.wall[('main', 'idle')] = 0.0
+    assert sorted(profiler.collapsed()) == [
+        'main;loop;handler 100000',
+        'main;loop;handler;parse 300000',
+        'main;loop;select 600000',
+    ]
+
+
+def test_report():
+    lines = make_profiler().report(top=2).splitlines()
+    assert lines[0] == 'Samples: 3, wall time: 1.000s'
+    # Top-2 by self time: select, parse
+    assert lines[3].split() == ['0.600', '60.0%', '0.600', '60.0%', 'select']
+    assert lines[4].split() == ['0.300', '30.0%', '0.300', '30.0%', 'parse']
+    assert len(lines) == 8
+    assert lines[7].split() == ['0.350', '0.400', 'handler']
+
+
+def test_coroutine_attribution():
+    profiler = SamplingProfiler()
+
+    async def inner():
+        return profiler.collect(sys._getframe())
+
+    async def outer():
+        return await inner()
+
+    stack = asyncio.run(outer())
+    assert profiler.root_coroutine(stack).startswith('outer ')
+    assert stack[-1].startswith('inner ')
+
+
+def test_sampling():
+    async def busy():
+        end = time.perf_counter() + 0.2
+        while time.perf_counter() < end: pass
+
+    with SamplingProfiler(interval=0.001) as profiler:
+        asyncio.run(busy())
+    assert sum(profiler.samples.values()) > 0
+    coroutines = profiler.coroutines()
+    label = next(x for x in coroutines if x.startswith('busy '))
+    assert coroutines[label][1] > 0
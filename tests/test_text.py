@@ -0,0 +1,25 @@
+from core.attachments.text import Text, make_soup
+from networks.tg import Telegram
+from markdown import markdown
+import pytest
+
+DOCUMENTS = [
+    '',
+    'hello',
+    '# Title\n\nSome *em* and **bold** `co<de> &amp;` [link](http://x.com/?a=1&b=2) \\*esc\\*',
+    '- a\n- b\n\n1. x\n2. y\n\n    code <x>\n    block &\n\n> quote\n\n---\n\nfoo & bar  \nbreak',
+    'raw <b>html</b> and &copy; entity',
+    '<http://auto.link> and <me@mail.com>',
+]
+
+
+@pytest.mark.parametrize('md', DOCUMENTS)
+def test_from_markdown_matches_html_round_trip(md):
+    tg = Telegram(token='')
+    assert str(Text.from_markdown(tg.pid, md).tree) == str(make_soup(markdown(md)))
+
+
+def test_from_markdown_many():
+    tg = Telegram(token='')
+    texts = Text.from_markdown_many(tg.pid, DOCUMENTS)
+    assert [str(x.tree) for x in texts] == [str(make_soup(markdown(x))) for x in DOCUMENTS]
@@ -0,0 +1,303 @@
+from core.attachments.general import Forward, DocumentType
+from core import RawJSON
+from networks.tg import Telegram, TgMessage, TgDocument, TgText, TgUpdateFilter
+import pytest
+import asyncio
+
+MESSAGE = {
+    'message_id': 1,
+    'date': 1600000000,
+    'from': {'id': 1, 'is_bot': False, 'first_name': 'James'},
+    'chat': {'id': 1, 'type': 'private'},
+}
+PHOTO = [
+    {'file_id': 'small', 'file_unique_id': 's', 'width': 90, 'height': 90, 'file_size': 100},
+    {'file_id': 'large', 'file_unique_id': 'l', 'width': 800, 'height': 600, 'file_size': 5000},
+]
+
+
+def test_media_caption_is_kept_once():
+    tg = Telegram(token='')
+    message = TgMessage.from_json(tg.pid, dict(MESSAGE, photo=PHOTO, caption='Look'))
+    assert len(message.content) == 1
+    document = message.content[0]
+    assert isinstance(document, TgDocument)
+    assert (document.caption, document.type, document._file_id) == ('Look', DocumentType.IMAGE, 'large')
+
+
+def test_text_message_has_no_document():
+    tg = Telegram(token='')
+    message = TgMessage.from_json(tg.pid, dict(MESSAGE, text='hi'))
+    assert [type(x) for x in message.content] == [TgText]
+
+
+def test_document_type_from_mime():
+    tg = Telegram(token='')
+    file = {'file_id': 'f', 'file_unique_id': 'u', 'mime_type': 'audio/ogg', 'file_name': 'a.ogg'}
+    message = TgMessage.from_json(tg.pid, dict(MESSAGE, document=file))
+    document = message.content[0]
+    assert (document.type, document.filename) == (DocumentType.AUDIO, 'a.ogg')
+
+
+def test_file_resolver_deduplicates_and_caches():
+    tg = Telegram(token='secret')
+    calls = []
+
+    async def request(method, data=None):
+        calls.append((method, data))
+        await asyncio.sleep(0)
+        return {'file_path': f'photos/{data["file_id"]}.jpg'}
+
+    tg.__dict__['request'] = request
+    message = TgMessage.from_json(tg.pid, dict(MESSAGE, photo=PHOTO))
+    document = message.content[0]
+
+    async def main():
+        urls = await asyncio.gather(*(document.resolve_url() for _ in range(5)))
+        urls.append(await document.resolve_url())
+        return urls
+
+    urls = asyncio.run(main())
+    assert set(urls) == {'https://api.telegram.org/file/botsecret/photos/large.jpg'}
+    assert calls == [('getFile', {'file_id': 'large'})]
+    assert document.url is None
+
+
+def update(update_id: int) -> dict:
+    return {'update_id': update_id, 'message': dict(MESSAGE, message_id=update_id, text='hi')}
+
+
+def test_adapt_limit_grows_on_full_batches_only():
+    tg = Telegram(token='', poll_limit_start=10, poll_limit_max=100)
+    assert tg.adapt_limit(10, 10) == 20
+    assert tg.adapt_limit(80, 80) == 100
+    assert tg.adapt_limit(100, 100) == 100
+    # Empty and partial batches never throttle the next burst
+    assert tg.adapt_limit(100, 0) == 100
+    assert tg.adapt_limit(40, 3) == 40
+
+
+def test_fetch_loop_long_polls_with_constant_limit_after_idle():
+    tg = Telegram(token='')
+    requests = []
+
+    async def request(method, data=None):
+        requests.append(data)
+        if len(requests) > 6: await asyncio.Event().wait()
+        return []
+
+    tg.__dict__['request'] = request
+
+    async def main():
+        fetcher = asyncio.ensure_future(tg.fetch_loop(asyncio.Queue()))
+        for _ in range(10): await asyncio.sleep(0)
+        fetcher.cancel()
+
+    asyncio.run(main())
+    assert {x['limit'] for x in requests} == {100}
+    assert {x['timeout'] for x in requests} == {tg.poll_timeout}
+
+
+def test_fetch_loop_moves_offset_only_after_handoff():
+    tg = Telegram(token='')
+    batches = [[update(1), update(2)], [update(3)], [update(4)]]
+    offsets = []
+
+    async def request(method, data=None):
+        offsets.append(data['offset'])
+        if batches: return batches.pop(0)
+        await asyncio.Event().wait()
+
+    tg.__dict__['request'] = request
+
+    async def main():
+        queue = asyncio.Queue(maxsize=1)
+        fetcher = asyncio.ensure_future(tg.fetch_loop(queue))
+        for _ in range(10): await asyncio.sleep(0)
+        # First batch is queued, second one is blocked on the full queue:
+        # updates 3+ are not acknowledged yet
+        assert offsets == [0, 3]
+        assert [x['update_id'] for x in await queue.get()] == [1, 2]
+        for _ in range(10): await asyncio.sleep(0)
+        assert offsets == [0, 3, 4]
+        fetcher.cancel()
+
+    asyncio.run(main())
+
+
+def test_fetcher_errors_reach_polling_loop():
+    tg = Telegram(token='')
+    calls = []
+
+    async def request(method, data=None):
+        calls.append(method)
+        if len(calls) == 1: return [update(1)]
+        raise OSError('network is down')
+
+    tg.__dict__['request'] = request
+
+    async def main():
+        await asyncio.wait_for(tg.polling_loop(), timeout=5)
+
+    with pytest.raises(OSError, match='network is down'):
+        asyncio.run(main())
+
+
+def ids(updates: list) -> list:
+    return [x['update_id'] for x in updates]
+
+
+def test_update_filter_drops_duplicates():
+    dedup = TgUpdateFilter(size=100, window=60)
+    assert ids(dedup.filter([update(1), update(2), update(1)])) == [1, 2]
+    assert ids(dedup.filter([update(2), update(3)])) == [3]
+    assert dedup.dropped == 2
+
+
+def test_update_filter_evicts_by_size():
+    dedup = TgUpdateFilter(size=2, window=60)
+    dedup.filter([update(1), update(2), update(3)])
+    # Only the 2 newest ids are remembered
+    assert ids(dedup.filter([update(1), update(3)])) == [1]
+    assert dedup.dropped == 1
+
+
+def test_update_filter_expires_after_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('networks.tg.time.monotonic', lambda: now[0])
+    dedup = TgUpdateFilter(size=100, window=60)
+    dedup.filter([update(1)])
+    now[0] += 30
+    dedup.filter([update(2)])
+    now[0] += 31
+    assert ids(dedup.filter([update(1), update(2)])) == [1]
+    assert dedup.dropped == 1
+
+
+def test_process_updates_skips_redelivered_batch():
+    tg = Telegram(token='')
+    processed = []
+    tg.__dict__['process_messages'] = lambda updates: processed.append(ids(updates))
+    batch = [update(1), update(2)]
+    tg.process_updates(batch)
+    tg.process_updates(batch)
+    tg.process_updates([update(2), update(3)])
+    assert processed == [[1, 2], [3]]
+    assert tg.dedup.dropped == 3
+
+
+MODES = {
+    'default': {},
+    'compact': {'compact_mode': True},
+    'keep_raw': {'compact_mode': True, 'keep_raw': True},
+}
+FORWARDER = {'id': 2, 'is_bot': False, 'first_name': 'Q'}
+
+
+def summary(message) -> tuple:
+    # Mode-independent view of a notified message
+    content = []
+    for x in message.content:
+        if isinstance(x, Forward): content.append(tuple(summary(m) for m in x.messages))
+        elif isinstance(x, TgDocument): content.append(('file', x._file_id, x.caption))
+        else: content.append(x.tree.get_text())
+    return (
+        message.id.native_id, message.when, message.sender and message.sender.id.native_id,
+        message.chat.id.native_id, tuple(content),
+    )
+
+
+def grouping_updates() -> list:
+    photo = lambda i: [dict(PHOTO[1], file_id=f'p{i}', file_unique_id=f'u{i}')]
+    forwarded = dict(forward_date=1500000000, forward_from=FORWARDER)
+    messages = [
+        dict(MESSAGE, message_id=1, text='look', date=1600000000),
+        dict(MESSAGE, message_id=2, photo=photo(2), media_group_id='g', caption='album', date=1600000001),
+        dict(MESSAGE, message_id=3, photo=photo(3), media_group_id='g', date=1600000001),
+        dict(MESSAGE, message_id=4, text='see this', date=1600000002),
+        dict(MESSAGE, message_id=5, text='first', date=1600000002, **forwarded),
+        dict(MESSAGE, message_id=6, text='second', date=1600000002, **forwarded),
+        dict(MESSAGE, message_id=7, text='bye', date=1600000003),
+    ]
+    return [{'update_id': i, 'message': x} for i, x in enumerate(messages)]
+
+
+def test_grouping_is_the_same_in_all_modes():
+    results = {}
+    for mode, options in MODES.items():
+        tg = Telegram(token='', **options)
+        notified = []
+        tg.__dict__['notify'] = notified.append
+        tg.process_updates(grouping_updates())
+        results[mode] = [summary(x) for x in notified]
+    assert results['compact'] == results['default']
+    assert results['keep_raw'] == results['default']
+    # Album is merged into one message, forwards are attached to the forwarder's one
+    assert [x[0] for x in results['default']] == ['1', '3', '4', '7']
+    album, holder = results['default'][1][4], results['default'][2][4]
+    assert album == (('file', 'p2', 'album'), ('file', 'p3', None))
+    assert holder[0] == 'see this' and len(holder[1]) == 2
+
+
+def test_keep_raw_payload_is_stored_once():
+    tg = Telegram(token='', compact_mode=True, keep_raw=True)
+    data = dict(MESSAGE, photo=PHOTO, caption='Look', forward_date=1500000000, forward_from=FORWARDER)
+    message = TgMessage.from_json(tg.pid, data)
+    raw = message.id.native_obj
+    assert isinstance(raw, RawJSON)
+    for obj in (message.sender, message.chat, message.content[0]):
+        assert obj.id.native_obj._encoded is raw._encoded
+    assert dict(message.sender.id.native_obj) == FORWARDER
+    assert dict(message.chat.id.native_obj) == MESSAGE['chat']
+    assert dict(message.content[0].id.native_obj) == PHOTO[1]
+
+
+def test_raw_json_is_not_cached():
+    raw = RawJSON({'a': {'b': [1, 2]}})
+    data = raw.copy()
+    data['a']['b'].append(3)
+    assert raw.copy() == {'a': {'b': [1, 2]}}
+    assert raw.view('a').decode() is not raw.view('a').decode()
+    assert dict(raw.view('a')) == {'b': [1, 2]}
+
+
+class Response:
+    def __init__(self, status: int, log: list):
+        self.status = status
+        self.log = log
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.log.append('released')
+
+    def raise_for_status(self):
+        if self.status >= 400: raise OSError(self.status)
+
+    async def read(self):
+        return b'data'
+
+
+@pytest.mark.parametrize('status', [200, 404])
+def test_download_releases_connection(status):
+    tg = Telegram(token='secret')
+    log = []
+
+    async def request(method, data=None):
+        return {'file_path': 'photos/large.jpg'}
+
+    class Session:
+        def get(self, url, headers):
+            log.append(headers)
+            return Response(status, log)
+
+    tg.__dict__['request'] = request
+    tg.__dict__['session'] = Session
+    document = TgMessage.from_json(tg.pid, dict(MESSAGE, photo=PHOTO)).content[0]
+    if status == 200:
+        assert asyncio.run(document.download(10, 5)) == b'data'
+    else:
+        with pytest.raises(OSError):
+            asyncio.run(document.download(10, 5))
+    assert log == [{'Range': 'bytes=10-14'}, 'released']